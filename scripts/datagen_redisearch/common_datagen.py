@@ -4,11 +4,18 @@ import shutil
 import tarfile
 import bz2
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from tqdm import tqdm
 
+# artifacts uploaded in parallel, and parallel part uploads within each artifact
+S3_UPLOAD_FILE_WORKERS = 4
+S3_UPLOAD_PART_WORKERS = 16
+
 
 def remove_file_if_exists(filename):
     if os.path.exists(filename):
@@ -84,22 +91,38 @@ def download_url(url, output_path):
 
 def upload_dataset_artifacts_s3(s3_bucket_name, s3_bucket_path, artifacts):
     print("-- uploading dataset artifacts to s3 -- ")
-    s3 = boto3.resource("s3")
-    bucket = s3.Bucket(s3_bucket_name)
-    progress = tqdm(unit="files", total=len(artifacts))
-    for input in artifacts:
+    # boto3 clients, unlike resources, can be shared between threads
+    # one pooled connection per concurrent part upload across all the files
+    s3 = boto3.client(
+        "s3",
+        config=Config(
+            max_pool_connections=S3_UPLOAD_FILE_WORKERS * S3_UPLOAD_PART_WORKERS
+        ),
+    )
+    transfer_config = TransferConfig(
+        multipart_threshold=8 * 1024 * 1024,
+        max_concurrency=S3_UPLOAD_PART_WORKERS,
+        multipart_chunksize=16 * 1024 * 1024,
+        use_threads=True,
+    )
+
+    def upload_artifact(input):
         object_key = "{bucket_path}{filename}".format(
             bucket_path=s3_bucket_path, filename=input
         )
-        print(
-            "https link: https://s3.amazonaws.com/{}/{}".format(
-                s3_bucket_name, object_key
+        s3.upload_file(input, s3_bucket_name, object_key, Config=transfer_config)
+        s3.put_object_acl(ACL="public-read", Bucket=s3_bucket_name, Key=object_key)
+        return object_key
+
+    progress = tqdm(unit="files", total=len(artifacts))
+    with ThreadPoolExecutor(max_workers=S3_UPLOAD_FILE_WORKERS) as executor:
+        for object_key in executor.map(upload_artifact, artifacts):
+            print(
+                "https link: https://s3.amazonaws.com/{}/{}".format(
+                    s3_bucket_name, object_key
+                )
             )
-        )
-        bucket.upload_file(input, object_key)
-        object_acl = s3.ObjectAcl(s3_bucket_name, object_key)
-        response = object_acl.put(ACL="public-read")
-        progress.update()
+            progress.update()
     progress.close()
 
 
@@ -162,12 +185,12 @@ def generate_setup_json(
 """ Returns a human readable string reprentation of bytes"""
 
 
-def humanized_bytes(bytes, units=[" bytes", "KB", "MB", "GB", "TB"]):
-    return (
-        str(bytes) + " " + units[0]
-        if bytes < 1024
-        else humanized_bytes(bytes >> 10, units[1:])
-    )
+def humanized_bytes(bytes, units=(" bytes", "KB", "MB", "GB", "TB")):
+    unit = 0
+    while bytes >= 1024 and unit < len(units) - 1:
+        bytes >>= 10
+        unit += 1
+    return str(bytes) + " " + units[unit]
 
 
 def add_key_metric(
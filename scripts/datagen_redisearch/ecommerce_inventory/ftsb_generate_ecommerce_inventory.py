@@ -1,12 +1,18 @@
 import re
 import time
-import uuid
+import collections
+import concurrent.futures
+import functools
+import itertools
 import argparse
 import csv
 import json
 import os
 import random
 import sys
+import numpy as np
+import zstandard
+from numba import njit
 from tqdm import tqdm
 
 # package local imports
@@ -15,7 +21,6 @@ sys.path.append(os.getcwd() + "/..")
 from common_datagen import (
     download_url,
     generate_setup_json,
-    compress_files,
     generate_inputs_dict_item,
     humanized_bytes,
     del_non_use_case_specific_keys,
@@ -28,320 +33,372 @@ from common_datagen import (
     remove_file_if_exists,
 )
 
+# tag sanitization pattern and the constant tag values it is applied to
+PATTERN = re.compile(r"[\W_]+")
+AVAIL_T = PATTERN.sub("", "true")
+AVAIL_F = PATTERN.sub("", "false")
+NODETYPE_STORE = PATTERN.sub("", "store")
+
+# extracts the seller names from the input CSV sellers column
+SELLER_RE = re.compile(r'"Seller_name_\d+"=>"([^"]+)"')
+
+# each input row generates MARKET_COUNT * NODES_PER_MARKET docs
+MARKET_COUNT = 5
+NODES_PER_MARKET = 10
+ROW_DOCS = MARKET_COUNT * NODES_PER_MARKET
+
+# input rows are handed to the worker processes in chunks of this many rows
+ROWS_PER_CHUNK = 256
+# bounds the chunks submitted but not yet written, per worker process, so that
+# finished chunks do not pile up in memory when the writer falls behind
+CHUNKS_IN_FLIGHT_PER_WORKER = 2
+
+# output files are written in batches of rows through large write buffers
+WRITE_BATCH_SIZE = 4096
+WRITE_BUFFER_SIZE = 1 << 20
+# characters that would require csv quoting, never present in generated rows
+CSV_SPECIAL_CHARS = ',"\r\n'
+
+
+class CompressedCopyWriter:
+    """Writes the same bytes to a csv file and to its zstd compressed copy,
+    so that the csv does not need to be read back to be compressed."""
+
+    def __init__(self, fname, compressed_fname):
+        self.file = open(fname, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.compressed_file = open(compressed_fname, "wb")
+        self.compressed_stream = zstandard.ZstdCompressor(
+            level=6, threads=-1
+        ).stream_writer(self.compressed_file)
+
+    def write(self, data):
+        self.file.write(data)
+        self.compressed_stream.write(data)
+
+    def close(self):
+        self.file.close()
+        # also closes the underlying compressed file
+        self.compressed_stream.close()
+
+
+@njit(cache=True)
+def _seed_row_numerics(seed):
+    # numba keeps its own random state, separate from numpy's and python's
+    np.random.seed(seed)
+
+
+@njit(cache=True)
+def _gen_row_numerics(row_docs, n_nodes, countries_alpha_cum, now):
+    quantities = np.empty((row_docs, 10), dtype=np.int64)
+    timestamps = np.empty((row_docs, 6), dtype=np.int64)
+    market_positions = np.empty(row_docs, dtype=np.int64)
+    node_positions = np.empty(row_docs, dtype=np.int64)
+    total_p = countries_alpha_cum[-1]
+    last_market = len(countries_alpha_cum) - 1
+    for doc_pos in range(row_docs):
+        for j in range(10):
+            quantities[doc_pos, j] = np.random.randint(0, 64001)
+        for j in range(6):
+            timestamps[doc_pos, j] = now + np.random.randint(0, 24 * 60 * 60 + 1)
+        market_positions[doc_pos] = min(
+            np.searchsorted(
+                countries_alpha_cum, np.random.random() * total_p, side="right"
+            ),
+            last_market,
+        )
+        node_positions[doc_pos] = np.random.randint(0, n_nodes)
+    return quantities, timestamps, market_positions, node_positions
+
+
+NUMERIC = "NUMERIC"
+TAG = "TAG"
+SCHEMA_FIELDS = [
+    ("market", TAG, ["SORTABLE"]),
+    ("nodeId", TAG, ["SORTABLE"]),
+    ("skuId", TAG, ["SORTABLE"]),
+    # onhand
+    ("onhand", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("onhandLastUpdatedTimestamp", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    # allocated
+    ("allocated", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("allocatedLastUpdatedTimestamp", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    # reserved
+    ("reserved", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("reservedLastUpdatedTimestamp", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    # store allocated
+    ("storeAllocated", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("storeAllocatedLastUpdatedTimestamp", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    # transfer allocated
+    ("transferAllocated", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("transferAllocatedLastUpdatedTimestamp", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    # store reserved
+    ("storeReserved", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("storeReservedLastUpdatedTimestamp", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("confirmedQuantity", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("standardSafetyStock", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("bopisSafetyStock", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    ("virtualHold", NUMERIC, ["SORTABLE", "NOINDEX"]),
+    # tags
+    ("availableToSource", TAG, []),
+    ("standardAvailableToPromise", TAG, []),
+    ("bopisAvailableToPromise", TAG, []),
+    ("nodeType", TAG, []),
+    ("brand", TAG, ["NOINDEX"]),
+    ("onHold", TAG, []),
+    ("exclusionType", TAG, []),
+]
+SCHEMA_FIELD_NAMES = [field for field, _, _ in SCHEMA_FIELDS]
+
+
+def format_doc_id(market, nodeId, doc_pos):
+    # the doc position, a monotonic counter, makes the doc ids unique
+    return "{market}_{nodeId}_{did:032x}".format(
+        market=market, nodeId=nodeId, did=doc_pos
+    )
+
+
+class DocsTable:
+    """Columnar index of the generated docs, holding only the fields reused by
+    the update commands. The full docs are streamed to disk as they are built.
+
+    Doc ids are unique by construction (their last part is the doc position),
+    so they are rebuilt on demand rather than stored or checked for collisions.
+    """
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.capacity = capacity
+        self.market = np.empty(capacity, dtype=object)
+        self.nodeId = np.empty(capacity, dtype=np.int64)
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, n):
+        if self.size + n <= self.capacity:
+            return
+        self.capacity = max(self.capacity * 2, self.size + n)
+        market = np.empty(self.capacity, dtype=object)
+        market[: self.size] = self.market[: self.size]
+        self.market = market
+        nodeId = np.empty(self.capacity, dtype=np.int64)
+        nodeId[: self.size] = self.nodeId[: self.size]
+        self.nodeId = nodeId
+
+    def doc_id(self, pos):
+        return format_doc_id(self.market[pos], self.nodeId[pos], pos)
+
+    def extend(self, markets, nodeIds):
+        n = len(markets)
+        self._reserve(n)
+        start = self.size
+        end = start + n
+        self.market[start:end] = markets
+        self.nodeId[start:end] = nodeIds
+        self.size = end
+
+
+def register_row_nodes(row, nodes, total_nodes):
+    # uniq_id,product_name,manufacturer,price,number_available_in_stock,number_of_reviews,number_of_answered_questions,average_review_rating,amazon_category_and_sub_category,customers_who_bought_this_item_also_bought,description,product_information,product_description,items_customers_buy_after_viewing_this_item,customer_questions_and_answers,customer_reviews,sellers
+    sellers_raw = row[16]
+    sellers = SELLER_RE.findall(sellers_raw)
+    for node in sellers:
+        if node not in nodes:
+            total_nodes = total_nodes + 1
+            nodeId = total_nodes
+            nodes[node] = nodeId
+    return nodes, total_nodes
+
 
 def process_inventory(
-    row,
-    market_count,
-    nodes,
+    skuId,
+    brand,
     total_nodes,
-    docs_map,
-    product_ids,
+    first_doc_id,
     countries_alpha_3,
-    countries_alpha_p,
+    countries_alpha_cum,
+    index,
+    lines,
+    cmd,
+    markets,
+    nodeIds,
 ):
-    # uniq_id,product_name,manufacturer,price,number_available_in_stock,number_of_reviews,number_of_answered_questions,average_review_rating,amazon_category_and_sub_category,customers_who_bought_this_item_also_bought,description,product_information,product_description,items_customers_buy_after_viewing_this_item,customer_questions_and_answers,customer_reviews,sellers
-    added_docs = 0
-    NUMERIC = "NUMERIC"
-    GEO = "GEO"
-    TAG = "TAG"
-    TEXT = "TEXT"
-    for inner_doc_pos in range(0, market_count):
-        skuId = row[0]
-        brand = row[2]
-        sellers_raw = row[16]
-        nodeType = "store"
-        availableToSource = "true"
-        standardAvailableToPromise = "true"
-        bopisAvailableToPromise = "true"
-        onHold = "false"
-        exclusionType = "false"
-
-        onhand = random.randint(0, 64000)
-        allocated = random.randint(0, 64000)
-        reserved = random.randint(0, 64000)
-        storeAllocated = random.randint(0, 64000)
-        transferAllocated = random.randint(0, 64000)
-        storeReserved = random.randint(0, 64000)
-        confirmedQuantity = random.randint(0, 64000)
-        standardSafetyStock = random.randint(0, 64000)
-        bopisSafetyStock = random.randint(0, 64000)
-        virtualHold = random.randint(0, 64000)
-
-        onhandLastUpdatedTimestamp = int(time.time() + random.randint(0, 24 * 60 * 60))
-        allocatedLastUpdatedTimestamp = int(
-            time.time() + random.randint(0, 24 * 60 * 60)
-        )
-        reservedLastUpdatedTimestamp = int(
-            time.time() + random.randint(0, 24 * 60 * 60)
-        )
-        storeAllocatedLastUpdatedTimestamp = int(
-            time.time() + random.randint(0, 24 * 60 * 60)
-        )
-        transferAllocatedLastUpdatedTimestamp = int(
-            time.time() + random.randint(0, 24 * 60 * 60)
+    brand = PATTERN.sub("", brand)
+    now = int(time.time())
+    quantities, timestamps, market_positions, node_positions = _gen_row_numerics(
+        ROW_DOCS, total_nodes, countries_alpha_cum, now
+    )
+    quantities = quantities.tolist()
+    timestamps = timestamps.tolist()
+    market_positions = market_positions.tolist()
+    node_positions = node_positions.tolist()
+    for doc_pos in range(0, ROW_DOCS):
+        # node ids are given in order of registration, starting at 1
+        nodeId = node_positions[doc_pos] + 1
+        market = countries_alpha_3[market_positions[doc_pos]]
+        doc_id = format_doc_id(market, nodeId, first_doc_id + doc_pos)
+        (
+            onhand,
+            allocated,
+            reserved,
+            storeAllocated,
+            transferAllocated,
+            storeReserved,
+            confirmedQuantity,
+            standardSafetyStock,
+            bopisSafetyStock,
+            virtualHold,
+        ) = quantities[doc_pos]
+        (
+            onhandLastUpdatedTimestamp,
+            allocatedLastUpdatedTimestamp,
+            reservedLastUpdatedTimestamp,
+            storeAllocatedLastUpdatedTimestamp,
+            transferAllocatedLastUpdatedTimestamp,
+            storeReservedLastUpdatedTimestamp,
+        ) = timestamps[doc_pos]
+        # doc values, in SCHEMA_FIELDS order
+        doc = (
+            market,
+            nodeId,
+            skuId,
+            onhand,
+            onhandLastUpdatedTimestamp,
+            allocated,
+            allocatedLastUpdatedTimestamp,
+            reserved,
+            reservedLastUpdatedTimestamp,
+            storeAllocated,
+            storeAllocatedLastUpdatedTimestamp,
+            transferAllocated,
+            transferAllocatedLastUpdatedTimestamp,
+            storeReserved,
+            storeReservedLastUpdatedTimestamp,
+            confirmedQuantity,
+            standardSafetyStock,
+            bopisSafetyStock,
+            virtualHold,
+            AVAIL_T,
+            AVAIL_T,
+            AVAIL_T,
+            NODETYPE_STORE,
+            brand,
+            AVAIL_F,
+            AVAIL_F,
         )
-        storeReservedLastUpdatedTimestamp = int(
-            time.time() + random.randint(0, 24 * 60 * 60)
+        lines.append(format_row(generate_ft_add_row(index, doc_id, doc, cmd)))
+        markets.append(market)
+        nodeIds.append(nodeId)
+
+
+def process_inventory_chunk(seed, index, countries_alpha_3, countries_alpha_cum, chunk):
+    # runs in a worker process: returns the chunk's FT.ADD rows already
+    # serialized as CSV, plus the fields of its docs reused by the updates
+    chunk_id, planned_rows = chunk
+    _seed_row_numerics(seed + chunk_id)
+    lines = []
+    cmd = []
+    markets = []
+    nodeIds = []
+    for skuId, brand, total_nodes, first_doc_id in planned_rows:
+        process_inventory(
+            skuId,
+            brand,
+            total_nodes,
+            first_doc_id,
+            countries_alpha_3,
+            countries_alpha_cum,
+            index,
+            lines,
+            cmd,
+            markets,
+            nodeIds,
         )
+    return "".join(lines).encode("utf-8"), markets, nodeIds
+
+
+# FT.AGGREGATE arguments following the query filter, identical for every read
+AGG_LOAD_TAIL = (
+    "LOAD",
+    "21",
+    "@market",
+    "@skuId",
+    "@nodeId",
+    "@brand",
+    "@nodeType",
+    "@onhand",
+    "@allocated",
+    "@confirmedQuantity",
+    "@reserved",
+    "@virtualHold",
+    "@availableToSource",
+    "@standardAvailableToPromise",
+    "@bopisAvailableToPromise",
+    "@storeAllocated",
+    "@bopisSafetyStock",
+    "@transferAllocated",
+    "@standardSafetyStock",
+    "@storeReserved",
+    "@availableToSource",
+    "@exclusionType",
+    "@onHold",
+    "WITHCURSOR",
+    "COUNT",
+    "500",
+)
 
-        pattern = re.compile("[\W_]+")
-
-        sellers = re.findall(r'\"Seller_name_\d+\"=>\"([^"]+)\"', sellers_raw)
-        if len(sellers) == 0:
-            available = "false"
-
-        for node in sellers:
-            if node not in nodes:
-                total_nodes = total_nodes + 1
-                nodeId = total_nodes
-                nodes[node] = nodeId
-
-        nodesList = list(nodes.keys())
-        if len(nodesList) > 0:
-            # k = 5 if 5 <= len(nodesList) else len(nodesList)
-            k = 10
-            for node in random.choices(nodesList, k=k):
-                # print(random.choices(nodesList, k=k))
-                nodeId = nodes[node]
-                did = str(uuid.uuid4()).replace("-", "")
-                if skuId not in product_ids:
-                    product_ids[skuId] = 1
-                else:
-                    product_ids[skuId] += 1
-                market = random.choices(countries_alpha_3, weights=countries_alpha_p)[0]
-                doc_id = "{market}_{nodeId}_{skuId}".format(
-                    market=market, nodeId=nodeId, skuId=did
-                )
 
-                if doc_id not in docs_map:
-                    doc = {
-                        "doc_id": doc_id,
-                        "schema": {
-                            "market": {
-                                "type": TAG,
-                                "value": market,
-                                "field_options": ["SORTABLE"],
-                            },
-                            "nodeId": {
-                                "type": TAG,
-                                "value": nodeId,
-                                "field_options": ["SORTABLE"],
-                            },
-                            "skuId": {
-                                "type": TAG,
-                                "value": skuId,
-                                "field_options": ["SORTABLE"],
-                            },
-                            # onhand
-                            "onhand": {
-                                "type": NUMERIC,
-                                "value": onhand,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "onhandLastUpdatedTimestamp": {
-                                "type": NUMERIC,
-                                "value": onhandLastUpdatedTimestamp,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # allocated
-                            "allocated": {
-                                "type": NUMERIC,
-                                "value": allocated,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "allocatedLastUpdatedTimestamp": {
-                                "type": NUMERIC,
-                                "value": allocatedLastUpdatedTimestamp,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # reserved
-                            "reserved": {
-                                "type": NUMERIC,
-                                "value": reserved,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "reservedLastUpdatedTimestamp": {
-                                "type": NUMERIC,
-                                "value": reservedLastUpdatedTimestamp,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # store allocated
-                            "storeAllocated": {
-                                "type": NUMERIC,
-                                "value": storeAllocated,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "storeAllocatedLastUpdatedTimestamp": {
-                                "type": NUMERIC,
-                                "value": storeAllocatedLastUpdatedTimestamp,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # transfer allocated
-                            "transferAllocated": {
-                                "type": NUMERIC,
-                                "value": transferAllocated,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "transferAllocatedLastUpdatedTimestamp": {
-                                "type": NUMERIC,
-                                "value": transferAllocatedLastUpdatedTimestamp,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # transfer allocated
-                            "storeReserved": {
-                                "type": NUMERIC,
-                                "value": storeReserved,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "storeReservedLastUpdatedTimestamp": {
-                                "type": NUMERIC,
-                                "value": storeReservedLastUpdatedTimestamp,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # store reserved
-                            "confirmedQuantity": {
-                                "type": NUMERIC,
-                                "value": confirmedQuantity,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "standardSafetyStock": {
-                                "type": NUMERIC,
-                                "value": standardSafetyStock,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "bopisSafetyStock": {
-                                "type": NUMERIC,
-                                "value": bopisSafetyStock,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            "virtualHold": {
-                                "type": NUMERIC,
-                                "value": virtualHold,
-                                "field_options": ["SORTABLE", "NOINDEX"],
-                            },
-                            # tags
-                            "availableToSource": {
-                                "type": TAG,
-                                "value": pattern.sub("", availableToSource),
-                                "field_options": [],
-                            },
-                            "standardAvailableToPromise": {
-                                "type": TAG,
-                                "value": pattern.sub("", standardAvailableToPromise),
-                                "field_options": [],
-                            },
-                            "bopisAvailableToPromise": {
-                                "type": TAG,
-                                "value": pattern.sub("", bopisAvailableToPromise),
-                                "field_options": [],
-                            },
-                            "nodeType": {
-                                "type": TAG,
-                                "value": pattern.sub("", nodeType),
-                                "field_options": [],
-                            },
-                            "brand": {
-                                "type": TAG,
-                                "value": pattern.sub("", brand),
-                                "field_options": ["NOINDEX"],
-                            },
-                            "onHold": {
-                                "type": TAG,
-                                "value": pattern.sub("", onHold),
-                                "field_options": [],
-                            },
-                            "exclusionType": {
-                                "type": TAG,
-                                "value": pattern.sub("", exclusionType),
-                                "field_options": [],
-                            },
-                        },
-                    }
-                    docs_map[doc_id] = doc
-                    dd = {k: v["value"] for k, v in doc["schema"].items()}
-
-                    #                     print("{")
-                    #                     for k, v in dd.items():
-                    #                         print(" \"{}\" : \"{}\",".format(k, v))
-                    #                     print("}")
-                    added_docs = added_docs + 1
-
-    return nodes, total_nodes, docs_map, added_docs, product_ids
-
-
-def generate_ft_aggregate_row(
-    index, countries_alpha_3, countries_alpha_p, maxSkusList, skus, maxNodesList, nodes
-):
-    product_id_list = []
-    market = random.choices(countries_alpha_3, weights=countries_alpha_p)[0]
+def pick_countries(rng, countries_alpha_cum, n):
+    # positions of n countries drawn with the --countries-alpha3-probability weights
+    draws = rng.random(n) * countries_alpha_cum[-1]
+    positions = np.searchsorted(countries_alpha_cum, draws, side="right")
+    return np.minimum(positions, len(countries_alpha_cum) - 1)
 
-    skuId_list = random.choices(skus, k=maxSkusList)
-    nodeId_list = random.choices(nodes, k=maxNodesList)
 
-    cmd = [
-        "READ",
-        "R1",
-        1,
-        "FT.AGGREGATE",
-        "{index}".format(index=index),
-        "@market:{{{0}}} @skuId:{{{1}}} @nodeId:{{{2}}}".format(
-            market, "|".join(skuId_list), "|".join(nodeId_list)
-        ),
-        "LOAD",
-        "21",
-        "@market",
-        "@skuId",
-        "@nodeId",
-        "@brand",
-        "@nodeType",
-        "@onhand",
-        "@allocated",
-        "@confirmedQuantity",
-        "@reserved",
-        "@virtualHold",
-        "@availableToSource",
-        "@standardAvailableToPromise",
-        "@bopisAvailableToPromise",
-        "@storeAllocated",
-        "@bopisSafetyStock",
-        "@transferAllocated",
-        "@standardSafetyStock",
-        "@storeReserved",
-        "@availableToSource",
-        "@exclusionType",
-        "@onHold",
-        "WITHCURSOR",
-        "COUNT",
-        "500",
-    ]
+def generate_ft_aggregate_row(index, market, skuId_list, nodeId_list):
+    skuIds = "|".join(skuId_list)
+    nodeIds = "|".join(nodeId_list)
+    query = f"@market:{{{market}}} @skuId:{{{skuIds}}} @nodeId:{{{nodeIds}}}"
+    cmd = ["READ", "R1", 1, "FT.AGGREGATE", index, query, *AGG_LOAD_TAIL]
     return cmd
 
 
-def generate_ft_add_row(index, doc):
-    cmd = [
-        "SETUP_WRITE",
-        "S1",
-        2,
-        "FT.ADD",
-        "{index}".format(index=index),
-        "{index}-{doc_id}".format(index=index, doc_id=doc["doc_id"]),
-        1.0,
-        "REPLACE",
-        "FIELDS",
-    ]
-    for f, v in doc["schema"].items():
+def format_row(cmd):
+    # generated fields never need csv quoting (the index name, countries and
+    # skuIds are checked against CSV_SPECIAL_CHARS and the remaining fields are
+    # sanitized or numeric), so rows are joined directly, with the same line
+    # terminator as csv.writer
+    return ",".join(map(str, cmd)) + "\r\n"
+
+
+def generate_ft_add_row(index, doc_id, doc, cmd):
+    cmd.clear()
+    cmd.extend(
+        (
+            "SETUP_WRITE",
+            "S1",
+            2,
+            "FT.ADD",
+            "{index}".format(index=index),
+            "{index}-{doc_id}".format(index=index, doc_id=doc_id),
+            1.0,
+            "REPLACE",
+            "FIELDS",
+        )
+    )
+    for f, v in zip(SCHEMA_FIELD_NAMES, doc):
         cmd.append(f)
-        cmd.append(v["value"])
+        cmd.append(v)
     return cmd
 
 
-def generate_ft_create_row(index, doc):
+def generate_ft_create_row(index):
     cmd = ["FT.CREATE", "{index}".format(index=index), "SCHEMA"]
-    for f, v in doc["schema"].items():
+    for f, field_type, field_options in SCHEMA_FIELDS:
         cmd.append(f)
-        cmd.append(v["type"])
-        if len(v["field_options"]) > 0:
-            cmd.extend(v["field_options"])
+        cmd.append(field_type)
+        if len(field_options) > 0:
+            cmd.extend(field_options)
     return cmd
 
 
@@ -350,14 +407,14 @@ def generate_ft_drop_row(index):
     return cmd
 
 
-def generate_ft_add_update_row(indexname, doc):
+def generate_ft_add_update_row(indexname, docs, pos):
     cmd = [
         "UPDATE",
         "U1",
         2,
         "FT.ADD",
         "{index}".format(index=indexname),
-        "{index}-{doc_id}".format(index=indexname, doc_id=doc["doc_id"]),
+        "{index}-{doc_id}".format(index=indexname, doc_id=docs.doc_id(pos)),
         1.0,
         "REPLACE",
         "PARTIAL",
@@ -369,9 +426,9 @@ def generate_ft_add_update_row(indexname, doc):
         TRUES if bool(random.getrandbits(1)) == True else FALSES
     )
     availableToSource = TRUES if bool(random.getrandbits(1)) == True else FALSES
-    market = doc["schema"]["market"]["value"]
-    nodeId = doc["schema"]["nodeId"]["value"]
-    nodeType = doc["schema"]["nodeType"]["value"]
+    market = docs.market[pos]
+    nodeId = docs.nodeId[pos]
+    nodeType = NODETYPE_STORE
     new = [
         "market",
         market,
@@ -390,32 +447,68 @@ def generate_ft_add_update_row(indexname, doc):
 
 
 def generate_setup_commands():
-    global progress, csvfile, nodes, total_nodes, docs_map, skusIds, total_docs
-    docs = []
+    global all_csvfile, progress, csvfile, nodes, total_nodes, docs, skusIds, total_docs
     print("-- generating the write commands -- ")
     print("Reading csv data to generate docs")
-    progress = tqdm(unit="docs", total=doc_limit)
-    while total_docs < doc_limit:
-        with open(input_data_filename, newline="") as csvfile:
-            spamreader = csv.reader(csvfile, delimiter=",")
-            for row in spamreader:
-                nodes, total_nodes, docs_map, added_docs, skusIds = process_inventory(
-                    row,
-                    5,
-                    nodes,
-                    total_nodes,
-                    docs_map,
-                    skusIds,
-                    countries_alpha_3,
-                    countries_alpha_p,
+    with open(input_data_filename, newline="") as csvfile:
+        rows = list(csv.reader(csvfile, delimiter=","))
+    # node ids, doc ids and the doc limit depend on the order of the rows,
+    # so the rows are planned sequentially before generating their docs
+    # rows are reused from the start for as long as more docs are needed
+    planned_rows = []
+    for row in itertools.cycle(rows):
+        nodes, total_nodes = register_row_nodes(row, nodes, total_nodes)
+        if total_nodes == 0:
+            continue
+        skuId = row[0]
+        if skuId not in skusIds:
+            # skuIds come unsanitized from the input file into unquoted rows
+            if any(c in skuId for c in CSV_SPECIAL_CHARS):
+                raise ValueError(
+                    "skuId {!r} in {} can not contain commas, quotes or line breaks".format(
+                        skuId, input_data_filename
+                    )
                 )
-                total_docs = total_docs + added_docs
-                if total_docs > doc_limit:
-                    break
-                progress.update(added_docs)
+            skusIds[skuId] = ROW_DOCS
+        else:
+            skusIds[skuId] += ROW_DOCS
+        planned_rows.append((skuId, row[2], total_nodes, total_docs))
+        total_docs = total_docs + ROW_DOCS
         if total_docs > doc_limit:
             break
+    chunks = [
+        planned_rows[pos : pos + ROWS_PER_CHUNK]
+        for pos in range(0, len(planned_rows), ROWS_PER_CHUNK)
+    ]
+    print("\t saving to {} and {}".format(setup_fname, all_fname))
+    # the ALL file is kept open to append the benchmark commands to it
+    all_csvfile = CompressedCopyWriter(all_fname, all_fname_compressed)
+    setup_csvfile = CompressedCopyWriter(setup_fname, setup_fname_compressed)
+    progress = tqdm(unit="docs", total=total_docs)
+    worker_fn = functools.partial(
+        process_inventory_chunk, seed, indexname, countries_alpha_3, countries_alpha_cum
+    )
+    workers = os.cpu_count()
+    chunks_iter = enumerate(chunks)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # chunks are written in order, keeping a bounded window of them in flight
+        pending = collections.deque(
+            executor.submit(worker_fn, chunk)
+            for chunk in itertools.islice(
+                chunks_iter, workers * CHUNKS_IN_FLIGHT_PER_WORKER
+            )
+        )
+        while pending:
+            csv_bytes, markets, nodeIds = pending.popleft().result()
+            next_chunk = next(chunks_iter, None)
+            if next_chunk is not None:
+                pending.append(executor.submit(worker_fn, next_chunk))
+            all_csvfile.write(csv_bytes)
+            setup_csvfile.write(csv_bytes)
+            docs.extend(markets, nodeIds)
+            progress.update(len(markets))
     progress.close()
+    setup_csvfile.close()
     total_skids = len(list(skusIds.keys()))
     print(
         "Generated {} total docs with {} distinct skids and {} distinct nodes".format(
@@ -424,58 +517,51 @@ def generate_setup_commands():
     )
 
 
-def save_setup_csv_command_list():
-    global all_csvfile, all_csv_writer, progress, doc, generated_row
-    all_csvfile = open(all_fname, "w", newline="")
-    setup_csvfile = open(setup_fname, "w", newline="")
-    all_csv_writer = csv.writer(all_csvfile, delimiter=",")
-    setup_csv_writer = csv.writer(setup_csvfile, delimiter=",")
-    progress = tqdm(unit="docs", total=total_docs)
-    for doc in docs_map.values():
-        generated_row = generate_ft_add_row(indexname, doc)
-        all_csv_writer.writerow(generated_row)
-        setup_csv_writer.writerow(generated_row)
-        progress.update()
-    progress.close()
-    all_csvfile.close()
-    setup_csvfile.close()
-
-
 def generate_benchmark_commands():
-    global all_csvfile, progress, doc, generated_row, total_updates, total_reads
+    global all_csvfile, progress, generated_row, total_updates, total_reads, rng
     print("-- generating {} update/read commands -- ".format(total_benchmark_commands))
     print("\t saving to {} and {}".format(bench_fname, all_fname))
-    all_csvfile = open(all_fname, "a", newline="")
-    bench_csvfile = open(bench_fname, "w", newline="")
-    all_csv_writer = csv.writer(all_csvfile, delimiter=",")
-    bench_csv_writer = csv.writer(bench_csvfile, delimiter=",")
-    docs_list = list(docs_map.values())
-    skusIds_list = list(skusIds.keys())
-    nodesIds = ["{}".format(x) for x in range(1, total_nodes)]
+    bench_csvfile = CompressedCopyWriter(bench_fname, bench_fname_compressed)
+    skusIds_list = np.array(list(skusIds.keys()), dtype=object)
+    nodesIds = np.array(["{}".format(x) for x in range(1, total_nodes)], dtype=object)
     progress = tqdm(unit="docs", total=total_benchmark_commands)
-    for _ in range(0, total_benchmark_commands):
-        choice = random.choices(["update", "read"], weights=[update_ratio, read_ratio])[
-            0
-        ]
-        if choice == "update":
-            random_doc_pos = random.randint(0, total_docs - 1)
-            doc = docs_list[random_doc_pos]
-            generated_row = generate_ft_add_update_row(indexname, doc)
-            total_updates = total_updates + 1
-        elif choice == "read":
-            generated_row = generate_ft_aggregate_row(
-                indexname,
-                countries_alpha_3,
-                countries_alpha_p,
-                max_skus_per_aggregate,
-                skusIds_list,
-                max_nodes_per_aggregate,
-                nodesIds,
+    for batch_start in range(0, total_benchmark_commands, WRITE_BATCH_SIZE):
+        batch_size = min(WRITE_BATCH_SIZE, total_benchmark_commands - batch_start)
+        # draw the random choices of the whole batch at once
+        is_update = rng.random(batch_size) < update_ratio
+        batch_updates = int(is_update.sum())
+        batch_reads = batch_size - batch_updates
+        update_doc_positions = iter(
+            rng.integers(0, total_docs, size=batch_updates).tolist()
+        )
+        read_markets = pick_countries(rng, countries_alpha_cum, batch_reads).tolist()
+        read_skus = skusIds_list[
+            rng.integers(
+                0, len(skusIds_list), size=(batch_reads, max_skus_per_aggregate)
             )
-            total_reads = total_reads + 1
-        all_csv_writer.writerow(generated_row)
-        bench_csv_writer.writerow(generated_row)
-        progress.update()
+        ].tolist()
+        read_nodes = nodesIds[
+            rng.integers(0, len(nodesIds), size=(batch_reads, max_nodes_per_aggregate))
+        ].tolist()
+        reads = zip(read_markets, read_skus, read_nodes)
+        batch = []
+        for update in is_update.tolist():
+            if update:
+                generated_row = generate_ft_add_update_row(
+                    indexname, docs, next(update_doc_positions)
+                )
+                total_updates = total_updates + 1
+            else:
+                market, skuId_list, nodeId_list = next(reads)
+                generated_row = generate_ft_aggregate_row(
+                    indexname, countries_alpha_3[market], skuId_list, nodeId_list
+                )
+                total_reads = total_reads + 1
+            batch.append(generated_row)
+        csv_bytes = "".join([format_row(row) for row in batch]).encode("utf-8")
+        all_csvfile.write(csv_bytes)
+        bench_csvfile.write(csv_bytes)
+        progress.update(batch_size)
     progress.close()
     bench_csvfile.close()
     all_csvfile.close()
@@ -569,6 +655,12 @@ if __name__ == "__main__":
     )
 
     args = parser.parse_args()
+    # the index name and countries end up in rows written without csv quoting
+    csv_args = [args.index_name] + args.countries_alpha3.split(",")
+    if any(c in csv_arg for csv_arg in csv_args for c in CSV_SPECIAL_CHARS):
+        parser.error(
+            "--index-name and --countries-alpha3 values can not contain commas, quotes or line breaks"
+        )
     use_case_specific_arguments = del_non_use_case_specific_keys(dict(args.__dict__))
 
     # generate the temporary working dir if required
@@ -590,15 +682,12 @@ if __name__ == "__main__":
     benchmark_config_file = "{test_name}.{project}.cfg.json".format(
         test_name=test_name, project=project
     )
-    s3_uri = "https://s3.amazonaws.com/{bucket_name}/{bucket_path}".format(
-        bucket_name=s3_bucket_name, bucket_path=s3_bucket_path
-    )
     all_fname = "{}.ALL.csv".format(benchmark_output_file)
     setup_fname = "{}.SETUP.csv".format(benchmark_output_file)
     bench_fname = "{}.BENCH.csv".format(benchmark_output_file)
-    all_fname_compressed = "{}.ALL.tar.gz".format(benchmark_output_file)
-    setup_fname_compressed = "{}.SETUP.tar.gz".format(benchmark_output_file)
-    bench_fname_compressed = "{}.BENCH.tar.gz".format(benchmark_output_file)
+    all_fname_compressed = "{}.ALL.csv.zst".format(benchmark_output_file)
+    setup_fname_compressed = "{}.SETUP.csv.zst".format(benchmark_output_file)
+    bench_fname_compressed = "{}.BENCH.csv.zst".format(benchmark_output_file)
     remote_url_all = "{}{}".format(s3_uri, all_fname_compressed)
     remote_url_setup = "{}{}".format(s3_uri, setup_fname_compressed)
     remote_url_bench = "{}{}".format(s3_uri, bench_fname_compressed)
@@ -618,10 +707,7 @@ if __name__ == "__main__":
     for artifact in all_artifacts:
         remove_file_if_exists(artifact)
 
-    seed = args.seed
     update_ratio = args.update_ratio
-    read_ratio = 1 - update_ratio
-    doc_limit = args.doc_limit
     total_benchmark_commands = args.total_benchmark_commands
     max_skus_per_aggregate = args.max_skus_per_aggregate
     max_nodes_per_aggregate = args.max_nodes_per_aggregate
@@ -721,7 +807,8 @@ if __name__ == "__main__":
 
     countries_alpha_3 = args.countries_alpha3.split(",")
     countries_alpha_p = [float(x) for x in args.countries_alpha3_probability.split(",")]
-    docs_map = {}
+    countries_alpha_cum = np.cumsum(countries_alpha_p)
+    docs = DocsTable(doc_limit)
     nodes = {}
     skusIds = {}
     total_nodes = 0
@@ -737,13 +824,12 @@ if __name__ == "__main__":
     )
     print("Using random seed {0}".format(args.seed))
     random.seed(args.seed)
+    rng = np.random.default_rng(args.seed)
 
     generate_setup_commands()
-    print("\t saving to {} and {}".format(setup_fname, all_fname))
-    save_setup_csv_command_list()
 
     print("-- generating the ft.create commands -- ")
-    ft_create_cmd = generate_ft_create_row(indexname, list(docs_map.values())[0])
+    ft_create_cmd = generate_ft_create_row(indexname)
     print("FT.CREATE command: {}".format(" ".join(ft_create_cmd)))
     setup_commands.append(ft_create_cmd)
 
@@ -776,9 +862,8 @@ if __name__ == "__main__":
         "deletes": total_deletes,
     }
 
-    status, uncompressed_size, compressed_size = compress_files(
-        [all_fname], all_fname_compressed
-    )
+    uncompressed_size = os.path.getsize(all_fname)
+    compressed_size = os.path.getsize(all_fname_compressed)
     inputs_entry_all = generate_inputs_dict_item(
         "all",
         all_fname,
@@ -791,9 +876,8 @@ if __name__ == "__main__":
         cmd_category_all,
     )
 
-    status, uncompressed_size, compressed_size = compress_files(
-        [setup_fname], setup_fname_compressed
-    )
+    uncompressed_size = os.path.getsize(setup_fname)
+    compressed_size = os.path.getsize(setup_fname_compressed)
     inputs_entry_setup = generate_inputs_dict_item(
         "setup",
         setup_fname,
@@ -806,9 +890,8 @@ if __name__ == "__main__":
         cmd_category_setup,
     )
 
-    status, uncompressed_size, compressed_size = compress_files(
-        [bench_fname], bench_fname_compressed
-    )
+    uncompressed_size = os.path.getsize(bench_fname)
+    compressed_size = os.path.getsize(bench_fname_compressed)
     inputs_entry_benchmark = generate_inputs_dict_item(
         "benchmark",
         bench_fname,